@@ -2,77 +2,105 @@
 import os
 import re
 import asyncio
-import json
+import codecs
+import socket
+import time
+from collections import defaultdict
 from typing import List, Tuple
+from urllib.parse import urlsplit
 
 import httpx
+import anyio
+import httpcore
+import orjson
 import phonenumbers
 from phonenumbers import PhoneNumberFormat, carrier
 import html as _html
 
-def _best_decode(resp):
-    # prefer server-declared encoding; else try utf-8; else cp1256; else iso-8859-6
+EMAIL_RE = re.compile(r"[A-Z0-9._%+-]+@[A-Z0-9.-]+\.[A-Z]{2,}", re.I)
+USER_RE = re.compile(r"[A-Za-z0-9_\.]{3,30}")
+DIGITS_RE = re.compile(r"\D")
+WS_RE = re.compile(r"\s+")
+NAME_JSON_RE = re.compile(r'"name"\s*:\s*"([^"]+)"', re.I)
+NAME_LABEL_RE = re.compile(r"(?:الاسم|name)\s*[:\-]\s*([^\n\r<]{3,60})", re.I)
+NAME_TABLE_RE = re.compile(r">(الاسم|name)\s*</td>\s*<td>\s*([^<]{3,60})", re.I)
+
+_BOMS = ((codecs.BOM_UTF8, "utf-8-sig"), (codecs.BOM_UTF16_LE, "utf-16"), (codecs.BOM_UTF16_BE, "utf-16"))
+
+def _best_decode(raw: bytes, declared: str | None = None):
+    # Server-declared charset, else a BOM, else utf-8. Any utf-8 decode (declared or not) is
+    # retried as cp1256 (common on Arabic pages) when it leaves more than 5% replacement chars;
+    # Arabic sites often claim utf-8 while serving cp1256. decode(errors="replace") never fails
+    # on bad bytes, so there is nothing to gain from trying a longer list.
     # return (text, used_encoding)
-    enc_order = []
-    if resp.encoding:
-        enc_order.append(resp.encoding)
-    enc_order += ["utf-8", "cp1256", "windows-1256", "iso-8859-6"]
-    raw = resp.content
-    for enc in enc_order:
-        try:
-            txt = raw.decode(enc, errors="replace")
-            return txt, enc
-        except Exception:
-            continue
-    return resp.text, resp.encoding or "unknown"
+    enc = declared
+    if not enc:
+        enc = next((name for bom, name in _BOMS if raw.startswith(bom)), "utf-8")
+    try:
+        enc = codecs.lookup(enc).name
+    except LookupError:
+        enc = "utf-8"
+    if enc != "utf-8":
+        return raw.decode(enc, errors="replace"), enc
+    txt = raw.decode("utf-8", errors="replace")
+    if txt.count("\ufffd") > len(txt) * 0.05:
+        return raw.decode("cp1256", errors="replace"), "cp1256"
+    return txt, "utf-8"
 
 def _clean_text(s: str) -> str:
     s = _html.unescape(s)
-    s = re.sub(r'\s+', ' ', s).strip()
+    s = WS_RE.sub(' ', s).strip()
     return s
 
 def _digits(s: str) -> str:
-    return re.sub(r"\D", "", s)
+    return DIGITS_RE.sub("", s)
 
 def build_sa_variants(text: str):
     d = _digits(text)
     if d.startswith("00"):
         d = d[2:]
-    variants = []
     if d.startswith("966"):
         rest = d[3:]
-        if rest:
-            variants.append(rest.lstrip("0"))         # 5XXXXXXXX
-            if not rest.startswith("0"):
-                variants.append("0" + rest)           # 05XXXXXXXX
-        variants.append("966" + (rest or ""))         # 9665XXXXXXXX
+        cands = (
+            rest.lstrip("0"),                                    # 5XXXXXXXX
+            "0" + rest if rest and rest[0] != "0" else "",       # 05XXXXXXXX
+            "966" + rest,                                        # 9665XXXXXXXX
+        )
     else:
         core = d.lstrip("0")
-        if core:
-            variants.append(core)                     # 5XXXXXXXX
-            variants.append("0" + core)               # 05XXXXXXXX
-            variants.append("966" + core)             # 9665XXXXXXXX
-    # dedup while preserving order & plausible lengths
-    seen=set(); out=[]
-    for v in variants:
-        if v and 8 <= len(v) <= 12 and v not in seen:
-            seen.add(v); out.append(v)
-    return out
+        cands = (core, "0" + core, "966" + core) if core else ()  # 5X.., 05X.., 9665X..
+    # The forms differ in length by construction, so no dedup pass is needed;
+    # just keep plausible lengths in order.
+    return [v for v in cands if 8 <= len(v) <= 12]
 
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
-from telegram.ext import Application, CommandHandler, MessageHandler, ConversationHandler, CallbackQueryHandler, ContextTypes, filters
+from telegram.constants import ChatAction
+from telegram.error import TelegramError
+from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, ContextTypes, filters
 
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 
-CHOOSING, INPUT_EMAIL, INPUT_PHONE, INPUT_USER = range(4)
-
 NEGATIVE_HINTS = [
     "not found", "doesn't exist", "page not found", "404", "sorry, this page isn't available",
     "user not found", "couldn’t find", "couldn't find", "no such user", "profile is unavailable"
 ]
+EMAIL_NEGATIVE_HINTS = ["invalid email", "no account", "not found", "does not exist", "unknown email"]
+
+# One alternation per hint list: a single scan over the body instead of one `in` per hint.
+# They match raw bytes (hints are lowercase; bytes.lower() folds ASCII, and the curly-quote
+# hint is matched by its UTF-8 encoding) so bodies are never decoded into a str.
+def _hints_re(hints: List[str]) -> "re.Pattern[bytes]":
+    return re.compile(b"|".join(re.escape(h.encode("utf-8")) for h in hints))
+
+NEGATIVE_RE = _hints_re(NEGATIVE_HINTS)
+EMAIL_NEGATIVE_RE = _hints_re(EMAIL_NEGATIVE_HINTS)
+
+def _has_hint(rx: "re.Pattern[bytes]", raw: bytes, cap: int = 2048) -> bool:
+    # Slice before lowercasing so the scan never touches more than `cap` bytes.
+    return rx.search(raw[:cap].lower()) is not None
 
 def is_email(s: str) -> bool:
-    return bool(re.fullmatch(r"[A-Z0-9._%+-]+@[A-Z0-9.-]+\.[A-Z]{2,}", s, re.I))
+    return bool(EMAIL_RE.fullmatch(s))
 
 def normalize_username(s: str) -> str:
     s = s.strip()
@@ -81,10 +109,14 @@ def normalize_username(s: str) -> str:
 
 def is_username(s: str) -> bool:
     s = normalize_username(s)
-    return bool(re.fullmatch(r"[A-Za-z0-9_\.]{3,30}", s))
+    return bool(USER_RE.fullmatch(s))
 
 def try_parse_phone(s: str, default_region: str = "SA"):
     s = s.strip()
+    # E.164 numbers have at most 15 digits; reject obvious junk before phonenumbers' parser.
+    digits = sum(c.isdigit() for c in s)
+    if digits < 7 or digits > 15:
+        return None
     try:
         num = phonenumbers.parse(s, default_region)
         if phonenumbers.is_valid_number(num):
@@ -93,6 +125,118 @@ def try_parse_phone(s: str, default_region: str = "SA"):
         return None
     return None
 
+HTTP_LIMITS = httpx.Limits(max_connections=200, max_keepalive_connections=100, keepalive_expiry=30)
+HTTP_TIMEOUT = httpx.Timeout(12.0, read=12.0, connect=12.0)
+
+# Shared across updates so pooled connections/TLS sessions survive between checks.
+# Created lazily by get_http_client() and closed by the application's post_shutdown hook.
+CLIENT: httpx.AsyncClient | None = None
+_CLIENT_LOCK = asyncio.Lock()
+
+DNS_TTL = 300.0
+HAPPY_EYEBALLS_DELAY = 0.25  # same stagger anyio.connect_tcp uses
+
+class CachingDNSBackend(httpcore.AsyncNetworkBackend):
+    """Network backend that resolves hosts through a TTL'd in-process getaddrinfo cache.
+
+    Connects race the cached addresses Happy Eyeballs style: a new attempt starts every
+    HAPPY_EYEBALLS_DELAY seconds (or as soon as the previous one fails) and the first
+    socket up wins. Resolve + race share one connect timeout. TLS still verifies against
+    the request's hostname: httpcore passes the origin host as server_hostname when
+    upgrading the stream, so only the TCP connect sees the IP.
+    """
+
+    def __init__(self, ttl: float = DNS_TTL):
+        self._backend = httpcore.AnyIOBackend()
+        self._ttl = ttl
+        self._cache: dict[str, Tuple[float, List[str]]] = {}
+
+    async def resolve(self, host: str, port: int = 443) -> List[str]:
+        hit = self._cache.get(host)
+        if hit and hit[0] > time.monotonic():
+            return hit[1]
+        infos = await anyio.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        addrs = list(dict.fromkeys(info[4][0] for info in infos))
+        self._cache[host] = (time.monotonic() + self._ttl, addrs)
+        return addrs
+
+    async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        try:
+            with anyio.fail_after(timeout):
+                addrs = await self.resolve(host, port)
+                stream = await self._race(addrs, port, local_address, socket_options)
+        except TimeoutError as e:
+            raise httpcore.ConnectTimeout(f"connect to {host} timed out") from e
+        except OSError as e:
+            raise httpcore.ConnectError(str(e)) from e
+        if stream is None:
+            self._cache.pop(host, None)
+            raise httpcore.ConnectError(f"all addresses failed for {host}")
+        return stream
+
+    async def _race(self, addrs, port, local_address, socket_options):
+        winner = None
+
+        async def attempt(addr, failed):
+            nonlocal winner
+            try:
+                stream = await self._backend.connect_tcp(
+                    addr, port, local_address=local_address, socket_options=socket_options
+                )
+            except (httpcore.ConnectError, httpcore.ConnectTimeout):
+                failed.set()
+                return
+            if winner is None:
+                winner = stream
+                tg.cancel_scope.cancel()
+            else:
+                await stream.aclose()
+
+        async with anyio.create_task_group() as tg:
+            for addr in addrs:
+                failed = anyio.Event()
+                tg.start_soon(attempt, addr, failed)
+                with anyio.move_on_after(HAPPY_EYEBALLS_DELAY):
+                    await failed.wait()
+        return winner
+
+    async def connect_unix_socket(self, path, timeout=None, socket_options=None):
+        return await self._backend.connect_unix_socket(path, timeout=timeout, socket_options=socket_options)
+
+    async def sleep(self, seconds):
+        await self._backend.sleep(seconds)
+
+DNS_BACKEND = CachingDNSBackend()
+DNS_CACHE_ACTIVE = False  # set once new_http_client() has installed DNS_BACKEND
+
+def new_http_client() -> httpx.AsyncClient:
+    transport = httpx.AsyncHTTPTransport(http2=True, limits=HTTP_LIMITS)
+    # httpx doesn't expose httpcore's network_backend option, so swap it on the httpcore pool
+    # it built. That's private API on both sides (requirements pin httpx and httpcore to known
+    # majors); if the layout ever changes we run without the DNS cache and say so.
+    global DNS_CACHE_ACTIVE
+    pool = getattr(transport, "_pool", None)
+    DNS_CACHE_ACTIVE = hasattr(pool, "_network_backend")
+    if DNS_CACHE_ACTIVE:
+        pool._network_backend = DNS_BACKEND
+    else:
+        print("WARNING: httpcore pool layout changed; DNS cache disabled")
+    return httpx.AsyncClient(timeout=HTTP_TIMEOUT, transport=transport, follow_redirects=True)
+
+async def get_http_client() -> httpx.AsyncClient:
+    global CLIENT
+    if CLIENT is None:
+        async with _CLIENT_LOCK:
+            if CLIENT is None:
+                CLIENT = new_http_client()
+    return CLIENT
+
+async def close_http_client(app=None):
+    global CLIENT
+    if CLIENT is not None:
+        await CLIENT.aclose()
+        CLIENT = None
+
 # ---- Original services (extracted from the provided Who-is-this.py) ---------
 # EMAIL endpoints (13 known):
 EMAIL_ENDPOINTS = [
@@ -111,276 +255,491 @@ EMAIL_ENDPOINTS = [
     ("Snapchat (merlin login)", "POST", "https://accounts.snapchat.com/accounts/merlin/login"),
 ]
 
+UA_HEADERS = {"User-Agent": "Mozilla/5.0"}
+XHR_HEADERS = {"X-Requested-With": "XMLHttpRequest", "User-Agent": "Mozilla/5.0"}
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+# Endpoints we can't query without a session; answered before any request work.
+SKIP_SITES = {
+    # The original endpoint is a mobile API that likely needs many params & device headers.
+    "TikTok (mobile)": "⏭️ TikTok: تخطّي (تحتاج mobile params/CSRF)",
+    "Snapchat (merlin login)": "⏭️ Snapchat (merlin): تخطّي (تحتاج جلسة/CSRF)",
+}
+
+# Request builders: (client, url, email) -> httpx.Request
+def _get(client, url, email):
+    return client.build_request("GET", url, headers=UA_HEADERS)
+
+def _post_empty(client, url, email):
+    return client.build_request("POST", url, data={})
+
+def _post_form(field, headers=None):
+    def request(client, url, email):
+        return client.build_request("POST", url, data={field: email}, headers=headers)
+    return request
+
+def _post_json(field, headers=JSON_HEADERS):
+    def request(client, url, email):
+        return client.build_request("POST", url, json={field: email}, headers=headers)
+    return request
+
+# Verdict parsers: (response, capped body) -> verdict string
+def _ms_parse(r: httpx.Response, body: bytes) -> str:
+    # Microsoft returns JSON with 'IfExistsResult'
+    try:
+        j = orjson.loads(body)
+        # 0 = not existing? 1/2 different providers; consider non-zero as exists
+        exists = j.get("IfExistsResult", -1) in (1,2)
+        return "✅ قد يكون البريد مستخدم (Microsoft)" if exists else "❌ غير موجود (Microsoft)"
+    except Exception:
+        return f"ℹ️ Microsoft: status {r.status_code}"
+
+def _tw_parse(r: httpx.Response, body: bytes) -> str:
+    try:
+        j = orjson.loads(body)
+        available = j.get("valid", False) and j.get("available", False)
+        return "❌ غير مستخدم على تويتر" if available else "✅ مستخدم/مرتبط على تويتر"
+    except Exception:
+        return f"ℹ️ Twitter: status {r.status_code}"
+
+def _generic_parse(r: httpx.Response, body: bytes) -> str:
+    # Generic heuristic: 200 with no obvious "not found" might indicate email accepted
+    negative = _has_hint(EMAIL_NEGATIVE_RE, body)
+    return "✅ مستلم/محتمل مرتبط" if (r.status_code < 400 and not negative) else "❌ غير مؤكد/مرفوض"
+
+# Per-site overrides; anything not listed is a plain GET (or empty-form POST) read by _generic_parse.
+EMAIL_REQUESTS = {
+    "Microsoft (officeapps.live)": (_get, _ms_parse),
+    "Twitter": (_get, _tw_parse),
+    "Instagram (recovery)": (_post_form("email_or_username", XHR_HEADERS), _generic_parse),
+    "Noon (reset)": (_post_json("email"), _generic_parse),
+    "ACAPS (password)": (_post_form("name"), _generic_parse),
+    "Vimeo (forgot)": (_post_form("email"), _generic_parse),
+    "NewsAPI (reset)": (_post_form("email"), _generic_parse),
+}
+
+# (site, url_template, request, parse), resolved once at import.
+EMAIL_PLAN = [
+    (site, url, *EMAIL_REQUESTS.get(site, (_get if method == "GET" else _post_empty, _generic_parse)))
+    for site, method, url in EMAIL_ENDPOINTS
+]
+
+# Verdicts only look at the start of the body (the JSON answers are a few hundred bytes).
+EMAIL_BODY_CAP = 4096
+
+async def _run_email(client: httpx.AsyncClient, plan, email: str) -> str:
+    site, url, request, parse = plan
+    if site in SKIP_SITES:
+        return SKIP_SITES[site]
+    r = await client.send(request(client, url.format(email=email), email), stream=True)
+    body = b""
+    try:
+        # An error status settles the verdict on its own; don't download the page.
+        if r.status_code < 400:
+            async for chunk in r.aiter_bytes():
+                body += chunk
+                if len(body) >= EMAIL_BODY_CAP:
+                    break
+    finally:
+        await r.aclose()
+    return f"{site}: {parse(r, body[:EMAIL_BODY_CAP])}"
+
 async def email_check(email: str) -> List[str]:
+    client = await get_http_client()
+    tasks = [_run_email(client, plan, email) for plan in EMAIL_PLAN]
+    results = await asyncio.gather(*tasks, return_exceptions=True)
     out = []
-    timeout = httpx.Timeout(12.0, read=12.0, connect=12.0)
-    async with httpx.AsyncClient(timeout=timeout, follow_redirects=True) as client:
-        for site, method, url in EMAIL_ENDPOINTS:
-            try:
-                if "{email}" in url:
-                    url_fmt = url.format(email=email)
-                else:
-                    url_fmt = url
-                if site == "TikTok (mobile)":
-                    # The original endpoint is a mobile API that likely needs many params & device headers.
-                    out.append("⏭️ TikTok: تخطّي (تحتاج mobile params/CSRF)")
-                    continue
-                if method == "GET":
-                    r = await client.get(url_fmt, headers={"User-Agent": "Mozilla/5.0"})
-                else:
-                    # Minimal body depending on endpoint
-                    data = {}
-                    if "instagram.com" in url_fmt:
-                        data = {"email_or_username": email}
-                        headers = {"X-Requested-With": "XMLHttpRequest", "User-Agent": "Mozilla/5.0"}
-                        r = await client.post(url_fmt, data=data, headers=headers)
-                    elif "noon.com" in url_fmt:
-                        data = {"email": email}
-                        r = await client.post(url_fmt, json=data, headers={"Content-Type": "application/json"})
-                    elif "acaps.org" in url_fmt:
-                        data = {"name": email}
-                        r = await client.post(url_fmt, data=data)
-                    elif "vimeo.com" in url_fmt:
-                        data = {"email": email}
-                        r = await client.post(url_fmt, data=data)
-                    elif "newsapi.org/reset-password" in url_fmt:
-                        data = {"email": email}
-                        r = await client.post(url_fmt, data=data)
-                    elif "snapchat.com/accounts/merlin/login" in url_fmt:
-                        out.append("⏭️ Snapchat (merlin): تخطّي (تحتاج جلسة/CSRF)")
-                        continue
-                    else:
-                        r = await client.post(url_fmt, data=data)
-                # Interpret response heuristically
-                status = r.status_code
-                text_l = ""
-                try:
-                    text_l = r.text.lower()[:2000]
-                except Exception:
-                    text_l = ""
-                verdict = None
-                if "officeapps.live" in url_fmt:
-                    # Microsoft returns JSON with 'IfExistsResult'
-                    try:
-                        j = r.json()
-                        # 0 = not existing? 1/2 different providers; consider non-zero as exists
-                        exists = j.get("IfExistsResult", -1) in (1,2)
-                        verdict = "✅ قد يكون البريد مستخدم (Microsoft)" if exists else "❌ غير موجود (Microsoft)"
-                    except Exception:
-                        verdict = f"ℹ️ Microsoft: status {status}"
-                elif "twitter.com/users/email_available" in url_fmt:
-                    try:
-                        j = r.json()
-                        available = j.get("valid", False) and j.get("available", False)
-                        verdict = "❌ غير مستخدم على تويتر" if available else "✅ مستخدم/مرتبط على تويتر"
-                    except Exception:
-                        verdict = f"ℹ️ Twitter: status {status}"
-                else:
-                    # Generic heuristic: 200 with no obvious "not found" might indicate email accepted
-                    negative = any(h in text_l for h in ["invalid email","no account","not found","does not exist","unknown email"])
-                    verdict = "✅ مستلم/محتمل مرتبط" if (status < 400 and not negative) else "❌ غير مؤكد/مرفوض"
-                out.append(f"{site}: {verdict}")
-            except Exception as e:
-                out.append(f"{site}: ⚠️ خطأ الشبكة/الحماية ({type(e).__name__})")
+    for (site, *_), res in zip(EMAIL_PLAN, results):
+        if isinstance(res, Exception):
+            out.append(f"{site}: ⚠️ خطأ الشبكة/الحماية ({type(res).__name__})")
+        else:
+            out.append(res)
     return out
 
 # PHONE endpoint (from original):
 
 CALLER_ID_URL = "http://caller-id.saedhamdan.com/index.php/UserManagement/search_number?number={number}&country_code={cc}"
+CALLER_ID_BODY_CAP = 8192
+CALLER_ID_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (compatible; who-bot/1.0)",
+    "Accept": "text/html,application/json;q=0.9,*/*;q=0.8",
+    "Referer": "http://caller-id.saedhamdan.com/",
+}
 
 def _digits_only(s: str) -> str:
-    return re.sub(r"\D", "", s)
+    return DIGITS_RE.sub("", s)
 
 
 
 
 def extract_name_from_text(txt: str):
-    # JSON-like
-    m = re.search(r'"name"\s*:\s*"([^"]+)"', txt, flags=re.I)
+    # JSON-like (also catches JSON that orjson rejected, e.g. cut off at the body cap)
+    m = NAME_JSON_RE.search(txt)
     if m: return m.group(1).strip()
     # Arabic label
-    m = re.search(r"(?:الاسم|name)\s*[:\-]\s*([^\n\r<]{3,60})", txt, flags=re.I)
+    m = NAME_LABEL_RE.search(txt)
     if m: return m.group(1).strip()
     # Table
-    m = re.search(r">(الاسم|name)\s*</td>\s*<td>\s*([^<]{3,60})", txt, flags=re.I)
+    m = NAME_TABLE_RE.search(txt)
     if m: return m.group(2).strip()
     return None
+
+NAME_KEYS = ("name", "Name", "callerName", "caller_name", "caller")
+
+def _json_name(j):
+    # Breadth-first over dicts and lists, so a top-level name wins over nested ones
+    # (e.g. {"data": [{"name": ...}]}).
+    queue = [j]
+    for node in queue:
+        if isinstance(node, dict):
+            for k in NAME_KEYS:
+                v = node.get(k)
+                if isinstance(v, str) and v.strip():
+                    return v.strip()
+            queue.extend(node.values())
+        elif isinstance(node, list):
+            queue.extend(node)
+    return None
+
+# Recent caller-id answers (including "no name"), keyed by (cc, variant). Network errors
+# aren't cached. Short TTL so stale caller-id data doesn't linger.
+PHONE_CACHE: dict[Tuple[str, str], Tuple[float, str | None]] = {}
+PHONE_CACHE_TTL = 600.0
+PHONE_CACHE_MAX = 4096
+_FETCH_FAILED = object()
+
+async def _lookup_variant(client: httpx.AsyncClient, v: str, cc: str):
+    hit = PHONE_CACHE.get((cc, v))
+    if hit and hit[0] > time.monotonic():
+        return hit[1]
+    name_val = await _fetch_variant(client, v, cc)
+    if name_val is not _FETCH_FAILED:
+        # Drop any expired entry first so the refresh moves to the end and never evicts another key.
+        PHONE_CACHE.pop((cc, v), None)
+        if len(PHONE_CACHE) >= PHONE_CACHE_MAX:
+            PHONE_CACHE.pop(next(iter(PHONE_CACHE)))  # oldest insertion first
+        PHONE_CACHE[(cc, v)] = (time.monotonic() + PHONE_CACHE_TTL, name_val)
+        return name_val
+    return None
+
+async def _fetch_variant(client: httpx.AsyncClient, v: str, cc: str):
+    url = CALLER_ID_URL.format(number=v, cc=cc)
+    try:
+        # The name sits near the top of the page; read at most CALLER_ID_BODY_CAP bytes.
+        buf = b""
+        async with client.stream("GET", url, headers=CALLER_ID_HEADERS) as r:
+            # Error pages (5xx, 429, WAF blocks) say nothing about the number; don't let them be cached as "no name".
+            if r.status_code >= 400:
+                return _FETCH_FAILED
+            async for chunk in r.aiter_bytes():
+                buf += chunk
+                if len(buf) >= CALLER_ID_BODY_CAP:
+                    break
+    except Exception as e:
+        return _FETCH_FAILED
+    txt, used_encoding = _best_decode(buf[:CALLER_ID_BODY_CAP], r.charset_encoding)
+    # JSON path
+    name_val = None
+    try:
+        name_val = _json_name(orjson.loads(buf[:CALLER_ID_BODY_CAP]))
+    except Exception:
+        pass
+    if not name_val:
+        name_val = extract_name_from_text(txt)
+    return name_val
+
 async def phone_check(raw: str) -> List[str]:
     cc = "SA"
     variants = build_sa_variants(raw)
     if not variants:
         return []
-    timeout = httpx.Timeout(12.0, read=12.0, connect=12.0)
-    headers = {
-        "User-Agent": "Mozilla/5.0 (compatible; who-bot/1.0)",
-        "Accept": "text/html,application/json;q=0.9,*/*;q=0.8",
-        "Referer": "http://caller-id.saedhamdan.com/",
-    }
-    async with httpx.AsyncClient(timeout=timeout, headers=headers, follow_redirects=True) as client:
-        for v in variants:
-            url = CALLER_ID_URL.format(number=v, cc=cc)
-            try:
-                r = await client.get(url)
-            except Exception as e:
-                continue
-            txt, used_encoding = _best_decode(r)
-            # JSON path
-            name_val = None
-            try:
-                j = r.json()
-                if isinstance(j, dict):
-                    for k in ["name","Name","callerName","caller_name","caller"]:
-                        if isinstance(j.get(k), str) and j[k].strip():
-                            name_val = j[k].strip(); break
-                    if not name_val:
-                        for vv in j.values():
-                            if isinstance(vv, dict):
-                                for kk in ["name","Name","callerName","caller_name"]:
-                                    if isinstance(vv.get(kk), str) and vv[kk].strip():
-                                        name_val = vv[kk].strip(); break
-                            if name_val: break
-            except Exception:
-                pass
-            if not name_val:
-                name_val = extract_name_from_text(txt)
-
+    client = await get_http_client()
+    # Query every variant at once and keep the first one that yields a name.
+    tasks = [asyncio.create_task(_lookup_variant(client, v, cc)) for v in variants]
+    try:
+        for fut in asyncio.as_completed(tasks):
+            name_val = await fut
             if name_val:
-                try:
-                    if "\\u" in name_val:
-                        name_val = json.loads(f'"{name_val}"')
-                except Exception:
-                    pass
                 return [name_val]
+    finally:
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
     return []
 
 
-            # USERNAME sites from Link_all.txt (exact list provided)
-def load_username_sites() -> List[str]:
+# USERNAME sites from Link_all.txt (exact list provided)
+SITES_FILE = "Link_all.txt"
+
+def load_username_sites() -> Tuple[Tuple[str, str], ...]:
+    # -> ((host, url_pattern), ...); host has no "www." and is used for display,
+    # per-host limits and failure backoff.
     try:
-        with open("Link_all.txt","r",encoding="utf-8") as f:
-            lines = [ln.strip() for ln in f if ln.strip() and not ln.startswith("#")]
-        return lines
+        # One read + one decode into a single buffer, then split; no per-line file iteration.
+        with open(SITES_FILE,"rb") as f:
+            text = f.read().decode("utf-8")
+        patterns = [ln.strip() for ln in text.splitlines() if ln.strip() and not ln.startswith("#")]
     except Exception:
-        return []
+        return ()
+    return tuple((urlsplit(p.replace("{}", "x")).netloc.removeprefix("www."), p) for p in patterns)
 
-async def username_check(username: str) -> List[str]:
+# Loaded once and reused; reloaded only when the file's mtime changes.
+USERNAME_SITES: Tuple[Tuple[str, str], ...] = ()
+_SITES_MTIME = None
+
+def refresh_username_sites():
+    global USERNAME_SITES, _SITES_MTIME
+    try:
+        mtime = os.stat(SITES_FILE).st_mtime
+    except OSError:
+        mtime = None
+    if mtime == _SITES_MTIME and USERNAME_SITES:
+        return
+    USERNAME_SITES = load_username_sites()
+    _SITES_MTIME = mtime
+
+refresh_username_sites()
+
+PROGRESS_BATCH = 20
+PROGRESS_INTERVAL = 1.5
+
+async def username_check(username: str, on_progress=None) -> List[str]:
+    # on_progress(lines) is awaited with the partial report every PROGRESS_BATCH
+    # results or PROGRESS_INTERVAL seconds, whichever comes first.
     username = normalize_username(username)
-    sites = load_username_sites()
+    refresh_username_sites()
+    client = await get_http_client()
+    urls = [pat.format(username) for _, pat in USERNAME_SITES]
+    hosts = {url: host for url, (host, _) in zip(urls, USERNAME_SITES)}
+    tasks = [_probe(client, url, host) for url, host in hosts.items()]
+    results = []
+    batch = 0
+    last_edit = time.monotonic()
+    for fut in asyncio.as_completed(tasks):
+        results.append(await fut)
+        batch += 1
+        if on_progress and len(results) < len(tasks):
+            if batch >= PROGRESS_BATCH or time.monotonic() - last_edit > PROGRESS_INTERVAL:
+                await on_progress([f"جاري الفحص… ({len(results)}/{len(tasks)})"] + _render_username(results, hosts))
+                batch = 0
+                last_edit = time.monotonic()
+    # Completion order is arbitrary; report in Link_all.txt order.
+    order = {url: i for i, url in enumerate(urls)}
+    results.sort(key=lambda r: order.get(r[0], 0))
+    out = _render_username(results, hosts)
+    return out if out else ["لم يتم التأكد من أي منصة."]
+
+def _render_username(results: List[Tuple[str, bool | None]], hosts: dict) -> List[str]:
+    # ok is None for hosts skipped by the failure backoff; they were never probed.
     out = []
-    timeout = httpx.Timeout(10.0, read=10.0, connect=10.0)
-    headers = {"User-Agent": "Mozilla/5.0 (compatible; who-bot/1.0)"}
-    async with httpx.AsyncClient(timeout=timeout, headers=headers, follow_redirects=True) as client:
-        tasks = []
-        for pat in sites:
-            url = pat.format(username)
-            tasks.append(_probe(client, url))
-        results = await asyncio.gather(*tasks, return_exceptions=False)
-    found = [u for u, ok in results if ok]
-    missing = [u for u, ok in results if not ok]
+    found = [f"• {u}" for u, ok in results if ok]
+    # just show domain names for brevity
+    missing = [f"• {hosts[u]}" for u, ok in results if ok is False]
+    skipped = [f"• {hosts[u]}" for u, ok in results if ok is None]
     if found:
         out.append("✅ موجود في:")
-        out += [f"• {u}" for u in found]
+        out.extend(found)
     if missing:
         out.append("\n❌ غير موجود/غير مؤكد في:")
-        # just show domain names for brevity
-        for u in missing:
-            out.append("• " + re.sub(r"^https?://(www\\.)?","",u).split("/")[0])
-    return out if out else ["لم يتم التأكد من أي منصة."]
+        out.extend(missing)
+    if skipped:
+        out.append("\n⏭️ لم يتم الفحص (أخطاء متكررة، سيعاد لاحقاً):")
+        out.extend(skipped)
+    return out
 
-async def _probe(client: httpx.AsyncClient, url: str) -> Tuple[str, bool]:
+USER_HEADERS = {"User-Agent": "Mozilla/5.0 (compatible; who-bot/1.0)"}
+USER_TIMEOUT = httpx.Timeout(10.0, read=10.0, connect=10.0)
+
+# Cap in-flight probes overall and per host so a large sites list can't flood the loop/pool.
+# Kept well under HTTP_LIMITS.max_connections so email/phone checks never wait on the pool.
+# Take the host slot before the global one, so probes queued on a busy host don't hold global slots.
+PROBE_CONCURRENCY = 32
+PROBE_PER_HOST = 4
+SEM = asyncio.Semaphore(PROBE_CONCURRENCY)
+HOST_SEMS: dict[str, asyncio.Semaphore] = defaultdict(lambda: asyncio.Semaphore(PROBE_PER_HOST))
+
+PROBE_BODY_CAP = 2048
+
+# Hosts that keep failing (network errors, 5xx) are skipped with exponential backoff so
+# repeat sweeps don't re-pay their timeouts. host -> (consecutive_failures, skip_until)
+FAIL_STATS: dict[str, Tuple[int, float]] = {}
+FAIL_THRESHOLD = 2
+FAIL_BASE_BACKOFF = 30  # well past USER_TIMEOUT, so a skip always saves more than one sweep's wait
+FAIL_MAX_BACKOFF = 300
+
+def _record_probe(host: str, failed: bool):
+    if not failed:
+        FAIL_STATS.pop(host, None)
+        return
+    n = FAIL_STATS.get(host, (0, 0.0))[0] + 1
+    skip_until = 0.0
+    if n >= FAIL_THRESHOLD:
+        skip_until = time.monotonic() + min(FAIL_MAX_BACKOFF, FAIL_BASE_BACKOFF * 2 ** (n - FAIL_THRESHOLD))
+    FAIL_STATS[host] = (n, skip_until)
+
+async def _probe(client: httpx.AsyncClient, url: str, host: str) -> Tuple[str, bool | None]:
+    if time.monotonic() < FAIL_STATS.get(host, (0, 0.0))[1]:
+        return (url, None)
     try:
-        r = await client.get(url)
+        async with HOST_SEMS[host], SEM:
+            # One GET: the status settles clear misses, and for the rest (soft-404s answer 200)
+            # only the first PROBE_BODY_CAP bytes of the page are read.
+            buf = b""
+            async with client.stream("GET", url, headers=USER_HEADERS, timeout=USER_TIMEOUT) as r:
+                if r.status_code < 400:
+                    async for chunk in r.aiter_bytes(PROBE_BODY_CAP):
+                        buf = chunk
+                        break
+        _record_probe(host, r.status_code >= 500)
         ok = r.status_code < 400
-        text = ""
-        try:
-            text = r.text.lower()[:2000]
-        except Exception:
-            text = ""
-        if any(h in text for h in NEGATIVE_HINTS):
+        if _has_hint(NEGATIVE_RE, buf, PROBE_BODY_CAP):
             ok = False
         return (url, ok)
     except Exception:
+        _record_probe(host, True)
         return (url, False)
 
 # ---- Telegram bot flow ------------------------------------------------------
 
-def main_menu():
-    kb = [
-        [InlineKeyboardButton("📧 فحص إيميل", callback_data="email")],
-        [InlineKeyboardButton("📞 فحص رقم", callback_data="phone")],
-        [InlineKeyboardButton("👤 فحص يوزر", callback_data="user")],
-    ]
-    return InlineKeyboardMarkup(kb)
+MAIN_MENU = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📧 فحص إيميل", callback_data="email")],
+    [InlineKeyboardButton("📞 فحص رقم", callback_data="phone")],
+    [InlineKeyboardButton("👤 فحص يوزر", callback_data="user")],
+])
+
+DONE_TEXT = "انتهى. اختر نوع فحص آخر:"
+
+def _split_lines(lines: List[str], limit: int = 4000) -> List[str]:
+    chunks, cur = [], ""
+    for ln in lines:
+        ln = ln[:limit]
+        if cur and len(cur) + 1 + len(ln) > limit:
+            chunks.append(cur)
+            cur = ln
+        else:
+            cur = f"{cur}\n{ln}" if cur else ln
+    if cur:
+        chunks.append(cur)
+    return chunks
+
+async def send_long(msg, lines: List[str]):
+    # Edit the placeholder with the first chunk and send the rest as new messages instead of
+    # truncating at Telegram's length limit; the menu goes on the last one.
+    chunks = _split_lines([*lines, "", DONE_TEXT])
+    last = len(chunks) - 1
+    await msg.edit_text(chunks[0], disable_web_page_preview=True, reply_markup=MAIN_MENU if last == 0 else None)
+    for i, chunk in enumerate(chunks[1:], 1):
+        await msg.chat.send_message(chunk, disable_web_page_preview=True, reply_markup=MAIN_MENU if i == last else None)
+
+# The chat flow is one hop (menu -> input -> result), so instead of a ConversationHandler the
+# pending input kind lives in user_data["mode"] ("email"/"phone"/"user", or absent while
+# choosing). Input handlers return the mode to stay in (None once the check is done).
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text("اختر نوع الفحص:", reply_markup=main_menu())
-    return CHOOSING
+    context.user_data.pop("mode", None)
+    await update.message.reply_text("اختر نوع الفحص:", reply_markup=MAIN_MENU)
+
+MENU_PROMPTS = {
+    "email": "أرسل الإيميل:",
+    "phone": "أرسل رقم الجوال (+9665xxxxxxxx أو 05xxxxxxxx):",
+    "user": "أرسل اليوزر (مثال: @username):",
+}
 
 async def on_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
-    choice = q.data
-    if choice == "email":
-        await q.edit_message_text("أرسل الإيميل:")
-        return INPUT_EMAIL
-    elif choice == "phone":
-        await q.edit_message_text("أرسل رقم الجوال (+9665xxxxxxxx أو 05xxxxxxxx):")
-        return INPUT_PHONE
-    else:
-        await q.edit_message_text("أرسل اليوزر (مثال: @username):")
-        return INPUT_USER
+    choice = q.data if q.data in MENU_PROMPTS else "user"
+    # The keyboard usually sits under a results message; drop just the keyboard and ask in a
+    # new message so the results stay readable.
+    try:
+        await q.edit_message_reply_markup(None)
+    except TelegramError:
+        pass
+    await q.message.reply_text(MENU_PROMPTS[choice])
+    context.user_data["mode"] = choice
 
 async def handle_email(update: Update, context: ContextTypes.DEFAULT_TYPE):
     email = update.message.text.strip()
     if not is_email(email):
         await update.message.reply_text("صيغة بريد غير صحيحة. حاول مرة أخرى.")
-        return INPUT_EMAIL
-    await update.message.reply_text("جاري الفحص…")
+        return "email"
+    await update.message.reply_chat_action(ChatAction.TYPING)
     res = await email_check(email)
-    await update.message.reply_text("\n".join(res)[:4000], disable_web_page_preview=True)
-    await update.message.reply_text("انتهى. اختر نوع فحص آخر:", reply_markup=main_menu())
-    return CHOOSING
+    await update.message.reply_text(
+        "\n".join(res)[:3900] + "\n\n" + DONE_TEXT, disable_web_page_preview=True, reply_markup=MAIN_MENU
+    )
+    return None
 
 
 async def handle_phone(update: Update, context: ContextTypes.DEFAULT_TYPE):
     raw = update.message.text.strip()
     res = await phone_check(raw)
     name_line = res[0] if res else ""
-    await update.message.reply_text(name_line if name_line else "—")
-    await update.message.reply_text("انتهى. اختر نوع فحص آخر:", reply_markup=main_menu())
-    return CHOOSING
+    await update.message.reply_text((name_line if name_line else "—") + "\n\n" + DONE_TEXT, reply_markup=MAIN_MENU)
+    return None
 
 
 async def handle_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uname = update.message.text.strip()
     if not is_username(uname) and not uname.startswith("@"):
         await update.message.reply_text("صيغة يوزر غير صحيحة. مثال: @example")
-        return INPUT_USER
-    await update.message.reply_text("جاري الفحص… قد يستغرق ثوانٍ.")
-    res = await username_check(uname)
-    await update.message.reply_text("\n".join(res)[:4000], disable_web_page_preview=True)
-    await update.message.reply_text("انتهى. اختر نوع فحص آخر:", reply_markup=main_menu())
-    return CHOOSING
+        return "user"
+    msg = await update.message.reply_text("جاري الفحص… قد يستغرق ثوانٍ.")
+
+    async def progress(lines):
+        try:
+            await msg.edit_text("\n".join(lines)[:4000], disable_web_page_preview=True)
+        except TelegramError:
+            pass  # e.g. rate-limited or unchanged text; the final edit still lands
+
+    res = await username_check(uname, on_progress=progress)
+    await send_long(msg, res)
+    return None
+
+ROUTES = {"email": handle_email, "phone": handle_phone, "user": handle_user}
+
+async def router(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    handler = ROUTES.get(context.user_data.get("mode"))
+    if handler is None:
+        return  # not waiting for input; same as text outside the old conversation states
+    mode = await handler(update, context)
+    if mode:
+        context.user_data["mode"] = mode
+    else:
+        context.user_data.pop("mode", None)
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    context.user_data.pop("mode", None)
     await update.message.reply_text("تم الإلغاء.")
-    return ConversationHandler.END
+
+async def warm_dns(app=None):
+    # Nothing to warm if the client can't use the cache.
+    await get_http_client()
+    if not DNS_CACHE_ACTIVE:
+        return
+    urls = [*(url for _, _, url in EMAIL_ENDPOINTS), CALLER_ID_URL, *(pat for _, pat in USERNAME_SITES)]
+    hosts = {urlsplit(u).hostname for u in urls} - {None}
+    await asyncio.gather(*[DNS_BACKEND.resolve(h) for h in hosts], return_exceptions=True)
+
+def _warmup():
+    # Load phonenumbers' SA metadata and carrier tables now so the first phone parse
+    # after startup doesn't pay for it; results are discarded.
+    num = phonenumbers.parse("+966500000000", "SA")
+    phonenumbers.is_valid_number(num)
+    carrier.name_for_number(num, "en")
 
 def build_app():
-    app = Application.builder().token(TELEGRAM_TOKEN).build()
-    conv = ConversationHandler(
-        entry_points=[CommandHandler("start", start)],
-        states={
-            CHOOSING: [CallbackQueryHandler(on_menu)],
-            INPUT_EMAIL: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_email)],
-            INPUT_PHONE: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_phone)],
-            INPUT_USER:  [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_user)],
-        },
-        fallbacks=[CommandHandler("cancel", cancel)],
-        name="whois_menu",
-        persistent=False,
+    _warmup()
+    app = (
+        Application.builder().token(TELEGRAM_TOKEN)
+        .post_init(warm_dns)
+        .post_shutdown(close_http_client)
+        .build()
     )
-    app.add_handler(conv)
+    app.add_handler(CommandHandler("start", start))
+    app.add_handler(CommandHandler("cancel", cancel))
+    app.add_handler(CallbackQueryHandler(on_menu))
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, router))
     return app
 
 
@@ -392,6 +751,11 @@ async def on_error(update, context):
 def main():
     if not TELEGRAM_TOKEN:
         raise RuntimeError("TELEGRAM_TOKEN env var is required")
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass  # optional; the default asyncio loop works, just slower under heavy fan-out
     app = build_app()
     app.add_error_handler(on_error)
     app.run_polling(allowed_updates=Update.ALL_TYPES)